@@ -2,19 +2,40 @@
 """Train a simple CNN on MNIST using checkpoints, integrated with Weights & Biases.
 
 The changes required to integrate checkpointing with wandb are tagged with 'NOTE'.
+
+Activation checkpointing (`--checkpoint_segments`) is unrelated to the checkpoints
+used for pre-emption. It discards intermediate activations in the forward pass and
+re-computes them during the backward pass. This costs extra compute, but reduces
+memory so that larger batch sizes fit on the GPU. The model is not compiled when
+activation checkpointing is enabled, because `checkpoint_sequential` calls the
+model's layers one by one and would bypass the compiled model.
 """
 
 from argparse import ArgumentParser
+from os import fdopen, path, replace
+from tempfile import mkstemp
+from typing import Tuple
 
 import wandb
-from torch import autocast, bfloat16, cuda, device, manual_seed
-from torch.cuda.amp import GradScaler
+from torch import (
+    Tensor,
+    autocast,
+    backends,
+    bfloat16,
+    channels_last,
+    cuda,
+    device,
+    load,
+    manual_seed,
+    randperm,
+    save,
+    set_float32_matmul_precision,
+)
 from torch.nn import Conv2d, CrossEntropyLoss, Flatten, Linear, ReLU, Sequential
 from torch.optim import SGD
 from torch.optim.lr_scheduler import CosineAnnealingLR
-from torch.utils.data import DataLoader
+from torch.utils.checkpoint import checkpoint_sequential
 from torchvision.datasets import MNIST
-from torchvision.transforms import ToTensor
 
 from wandb_preempt.checkpointer import Checkpointer
 
@@ -32,27 +53,63 @@ def get_parser():
         "--epochs", type=int, default=20, help="Number of epochs. Default: %(default)s"
     )
     parser.add_argument(
-        "--batch_size", type=int, default=256, help="Batch size. Default: %(default)s"
+        "--batch_size", type=int, default=1024, help="Batch size. Default: %(default)s"
     )
     parser.add_argument(
         "--checkpoint_dir", type=str, default="checkpoints", help="Checkpoint save dir."
     )
+    parser.add_argument(
+        "--checkpoint_segments",
+        type=int,
+        default=0,
+        help="Number of segments for activation checkpointing, 0 disables it. "
+        "Default: %(default)s",
+    )
     return parser
 
 
+def load_mnist(data_dir: str = "./data") -> Tuple[Tensor, Tensor]:
+    r"""Load the MNIST training images and labels as tensors.
+
+    The tensors are cached in a single file, which is faster to load than the data
+    set in subsequent runs.
+    """
+    cache = path.join(data_dir, "mnist_train.pt")
+    if path.exists(cache):
+        return load(cache, weights_only=True)
+
+    try:  # only download the data set if it is missing
+        train_dataset = MNIST(data_dir, train=True, download=False)
+    except RuntimeError:
+        train_dataset = MNIST(data_dir, train=True, download=True)
+    images, labels = train_dataset.data, train_dataset.targets
+    # Write to a unique temporary file first, because other runs, possibly on other
+    # nodes sharing the data directory, may read or write the cache concurrently
+    fd, tmp_cache = mkstemp(dir=data_dir, suffix=".tmp")
+    with fdopen(fd, "wb") as f:
+        save((images, labels), f)
+    replace(tmp_cache, cache)
+    return images, labels
+
+
 def main(args):
     r"""Train model."""
     manual_seed(0)  # make deterministic
     DEV = device("cuda" if cuda.is_available() else "cpu")
+    # Let cuDNN pick the fastest convolution kernels for our (fixed) input shapes and
+    # allow TensorFloat-32 for matrix multiplications in float32
+    backends.cudnn.benchmark = True
+    set_float32_matmul_precision("high")
 
     # NOTE: Allow runs to resume by passing 'allow' to wandb
     run = wandb.init(resume="allow")
 
     # Set up the data, neural net, loss function, and optimizer
-    train_dataset = MNIST("./data", train=True, download=True, transform=ToTensor())
-    train_loader = DataLoader(
-        dataset=train_dataset, batch_size=args.batch_size, shuffle=True
-    )
+    images, labels = load_mnist()
+    # MNIST is small enough to move it to the device once, rather than loading and
+    # transferring every mini-batch. Scaling to [0, 1] is equivalent to `ToTensor`.
+    train_inputs = images.unsqueeze(1).to(DEV).float().div_(255)
+    train_targets = labels.to(DEV)
     model = Sequential(
         Conv2d(1, 3, kernel_size=5, stride=2),
         ReLU(),
@@ -61,11 +118,24 @@ def main(args):
         ReLU(),
         Linear(50, 10),
     ).to(DEV)
-    loss_func = CrossEntropyLoss().to(DEV)
+    # Convolutions with Tensor Cores are fastest in channels-last (NHWC) layout
+    model = model.to(memory_format=channels_last)
+    # Compile the model to fuse its kernels and capture them in a CUDA graph, which
+    # removes kernel launch overhead. We compile in-place, which leaves the state
+    # dict keys (and checkpoints) unchanged. Compilation mostly pays off on GPU, so
+    # we stay in eager mode on CPU, and with activation checkpointing, which calls
+    # the layers one by one (see the module docstring).
+    if cuda.is_available() and args.checkpoint_segments == 0:
+        model.compile(mode="reduce-overhead", fullgraph=True)
+    loss_func = CrossEntropyLoss()
     print(f"Using SGD with learning rate {args.lr_max}.")
-    optimizer = SGD(model.parameters(), lr=args.lr_max)
+    # Update all parameters with a single fused kernel on GPU, otherwise fall back
+    # to the multi-tensor implementation
+    use_fused = cuda.is_available()
+    optimizer = SGD(
+        model.parameters(), lr=args.lr_max, fused=use_fused, foreach=not use_fused
+    )
     lr_scheduler = CosineAnnealingLR(optimizer, T_max=args.epochs)
-    scaler = GradScaler()
 
     # NOTE: Set up a check-pointer which will load and save checkpoints.
     # Pass the run ID to obtain unique file names for the checkpoints.
@@ -74,7 +144,6 @@ def main(args):
         model,
         optimizer,
         lr_scheduler=lr_scheduler,
-        scaler=scaler,
         savedir=args.checkpoint_dir,
         verbose=VERBOSE,
     )
@@ -89,28 +158,42 @@ def main(args):
     # training
     for epoch in range(start_epoch, args.epochs):
         model.train()
-        for step, (inputs, target) in enumerate(train_loader):
-            optimizer.zero_grad()
+        # Shuffle the data and split it into mini-batches. We drop the last incomplete
+        # mini-batch so that all batches have the same shape and the CUDA graph can be
+        # replayed.
+        num_samples = len(train_inputs) // args.batch_size * args.batch_size
+        permutation = randperm(len(train_inputs), device=DEV)[:num_samples]
+        batches = permutation.split(args.batch_size)
+        for step, batch in enumerate(batches):
+            inputs = train_inputs[batch].contiguous(memory_format=channels_last)
+            target = train_targets[batch]
+            optimizer.zero_grad(set_to_none=True)
 
             with autocast(device_type="cuda", dtype=bfloat16):
-                output = model(inputs.to(DEV))
-                loss = loss_func(output, target.to(DEV))
+                if args.checkpoint_segments > 0:
+                    output = checkpoint_sequential(
+                        model, args.checkpoint_segments, inputs, use_reentrant=False
+                    )
+                else:
+                    output = model(inputs)
+                loss = loss_func(output, target)
 
             if step % LOGGING_INTERVAL == 0:
-                print(f"Epoch {epoch}, Step {step}, Loss {loss.item():.5e}")
+                # `.item()` synchronizes with the GPU, so we only call it once
+                loss_val = loss.item()
+                print(f"Epoch {epoch}, Step {step}, Loss {loss_val:.5e}")
                 wandb.log(
                     {
-                        "loss": loss.item(),
+                        "loss": loss_val,
                         "lr": optimizer.param_groups[0]["lr"],
-                        "loss_scale": scaler.get_scale(),
                         "epoch": epoch,
                         "resumes": checkpointer.num_resumes,
                     }
                 )
 
-            scaler.scale(loss).backward()
-            scaler.step(optimizer)  # update neural network parameters
-            scaler.update()  # update the gradient scaler
+            # bfloat16 has the same range as float32, so we need no gradient scaler
+            loss.backward()
+            optimizer.step()  # update neural network parameters
 
         lr_scheduler.step()  # update learning rate
 
@@ -1,23 +1,72 @@
 """Check that the training script is working."""
 
-from os import environ, getenv, path
+from os import path
+from signal import SIGTERM, SIGUSR1, getsignal, signal
 from test.utils import run_verbose
 
+from example.train import get_parser, main
+from pytest import MonkeyPatch, fixture, mark
+from torch import (
+    backends,
+    cuda,
+    get_float32_matmul_precision,
+    get_rng_state,
+    set_float32_matmul_precision,
+    set_rng_state,
+)
+
 HERE_DIR = path.dirname(path.abspath(__file__))
 TRAINING_SCRIPT = path.abspath(path.join(HERE_DIR, "..", "..", "example", "train.py"))
 
 
-def test_training_script():
-    """Execute the training script."""
+@fixture
+def restore_global_state(monkeypatch: MonkeyPatch):
+    """Restore the global state the training script modifies after a test.
+
+    The checkpointer replaces the handlers of pre-emption signals, and the script
+    configures PyTorch and seeds its random number generators.
+
+    Args:
+        monkeypatch: Fixture to temporarily modify attributes.
+
+    Yields:
+        Nothing. The global state is restored after the test.
+    """
+    handlers = {sig: getsignal(sig) for sig in (SIGTERM, SIGUSR1)}
+    monkeypatch.setattr(backends.cudnn, "benchmark", backends.cudnn.benchmark)
+    precision = get_float32_matmul_precision()
+    rng_state = get_rng_state()
+    cuda_rng_states = cuda.get_rng_state_all() if cuda.is_available() else None
+
+    yield
+
+    for sig, handler in handlers.items():
+        signal(sig, handler)
+    set_float32_matmul_precision(precision)
+    set_rng_state(rng_state)
+    if cuda_rng_states is not None:
+        cuda.set_rng_state_all(cuda_rng_states)
+
+
+def test_training_script(monkeypatch: MonkeyPatch, restore_global_state):
+    """Run the training script in the current Python session.
+
+    Args:
+        monkeypatch: Fixture to temporarily modify environment variables.
+        restore_global_state: Fixture to undo the script's changes of global state.
+    """
     # Use wandb in offline mode. We do not want to upload the logs this test generates
-    ORIGINAL_WANDB_MODE = getenv("WANDB_MODE")
-    environ["WANDB_MODE"] = "offline"
+    monkeypatch.setenv("WANDB_MODE", "offline")
+    main(get_parser().parse_args(["--epochs=3"]))
 
-    # Run the training script
-    run_verbose(["python", TRAINING_SCRIPT, "--epochs=3"])
 
-    # Restore the original value of WANDB_MODE
-    if ORIGINAL_WANDB_MODE is None:
-        environ.pop("WANDB_MODE")
-    else:
-        environ["WANDB_MODE"] = ORIGINAL_WANDB_MODE
+@mark.expensive
+def test_training_script_cli(monkeypatch: MonkeyPatch):
+    """Execute the training script from the command line.
+
+    Args:
+        monkeypatch: Fixture to temporarily modify environment variables.
+    """
+    # Use wandb in offline mode. We do not want to upload the logs this test generates
+    monkeypatch.setenv("WANDB_MODE", "offline")
+    run_verbose(["python", TRAINING_SCRIPT, "--epochs=3"])
@@ -0,0 +1,301 @@
+"""Test `wandb_preempt.checkpointer`."""
+
+import os
+from typing import Dict, List, Optional, Tuple, Type
+
+from pytest import MonkeyPatch, mark
+from torch import Tensor, allclose, bfloat16, float32, load, manual_seed, rand
+from torch.nn import Linear, Sequential
+from torch.optim import SGD, Adam, Optimizer
+
+from wandb_preempt import Checkpointer, checkpointer
+
+
+def _train_step(model: Linear, optimizer: Optimizer):
+    """Perform a training step on random data.
+
+    Args:
+        model: The model to train.
+        optimizer: The model's optimizer.
+    """
+    optimizer.zero_grad()
+    model(rand(8, model.in_features)).square().sum().backward()
+    optimizer.step()
+
+
+def _save(
+    savedir: str, model: Linear, optimizer: Optional[Optimizer] = None, **kwargs
+) -> Checkpointer:
+    """Save a checkpoint, after a training step if an optimizer is given.
+
+    Args:
+        savedir: Directory to store the checkpoint in.
+        model: The model to checkpoint.
+        optimizer: The model's optimizer. Default: `None`.
+        **kwargs: Additional keyword arguments for the `Checkpointer`.
+
+    Returns:
+        The checkpointer that saved the checkpoint.
+    """
+    checkpointer = Checkpointer("run", model, optimizer, savedir=savedir, **kwargs)
+    if optimizer is not None:
+        _train_step(model, optimizer)
+    checkpointer.step()
+    checkpointer.wait_for_pending_save()
+    return checkpointer
+
+
+def _resume(
+    savedir: str,
+    model: Linear,
+    optimizer: Optional[Optimizer] = None,
+    model_state: Optional[Dict[str, Tensor]] = None,
+) -> Tuple[Checkpointer, Optional[Optimizer], Optional[int], Dict]:
+    """Load the latest checkpoint into a new model and check the model's state.
+
+    Args:
+        savedir: Directory the checkpoint is stored in.
+        model: The model that was checkpointed.
+        optimizer: The model's optimizer. If specified, a new optimizer of the same
+            type is created and loaded, too. Default: `None`.
+        model_state: The model state the checkpoint must contain. If `None`, the
+            model's current state is used. Default: `None`.
+
+    Returns:
+        The checkpointer that loaded the checkpoint, the new optimizer (`None` if no
+        optimizer was specified), and the loaded step and extra information returned
+        by `load_latest_checkpoint`.
+    """
+    new_model = Linear(model.in_features, model.out_features)
+    new_optimizer = (
+        None
+        if optimizer is None
+        else type(optimizer)(new_model.parameters(), **optimizer.defaults)
+    )
+    checkpointer = Checkpointer("run", new_model, new_optimizer, savedir=savedir)
+    loaded_step, extra_info = checkpointer.load_latest_checkpoint()
+
+    model_state = model.state_dict() if model_state is None else model_state
+    for key, value in new_model.state_dict().items():
+        assert allclose(value, model_state[key])
+    return checkpointer, new_optimizer, loaded_step, extra_info
+
+
+@mark.parametrize("full_checkpoint_every", [1, 2], ids=["full", "delta"])
+@mark.parametrize("save_in_subprocess", [False, True], ids=["thread", "process"])
+def test_save_and_load(tmp_path, save_in_subprocess: bool, full_checkpoint_every: int):
+    """Test that loading the latest checkpoint restores the saved states.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+        save_in_subprocess: Whether to write checkpoints in a separate process.
+        full_checkpoint_every: Interval between full checkpoints.
+    """
+    manual_seed(0)
+    model = Linear(5, 3)
+    model.bias.requires_grad_(False)  # frozen tensors need not be saved every time
+    optimizer = Adam(model.parameters())
+    checkpointer = Checkpointer(
+        "run",
+        model,
+        optimizer,
+        savedir=str(tmp_path),
+        save_in_subprocess=save_in_subprocess,
+        full_checkpoint_every=full_checkpoint_every,
+    )
+
+    num_steps = 4
+    for step in range(num_steps):
+        _train_step(model, optimizer)
+        checkpointer.step(extra_info={"step": step})
+    checkpointer.wait_for_pending_save()
+    # only the latest, its predecessor, and the full checkpoint they need may exist
+    max_checkpoints = 2 if full_checkpoint_every == 1 else 3
+    assert len(checkpointer.all_checkpoints()) <= max_checkpoints
+
+    # modifying the states after saving must not affect the checkpoint
+    saved_state = {k: v.clone() for k, v in model.state_dict().items()}
+    _train_step(model, optimizer)
+
+    new_checkpointer, new_optimizer, loaded_step, extra_info = _resume(
+        str(tmp_path), model, optimizer, model_state=saved_state
+    )
+
+    assert loaded_step == num_steps - 1
+    assert extra_info == {"step": num_steps - 1}
+    assert new_checkpointer.step_count == num_steps
+    assert new_checkpointer.num_resumes == 1
+    assert new_optimizer.state_dict()["state"][0]["step"] == num_steps
+
+    new_checkpointer.remove_checkpoints()
+    assert not new_checkpointer.all_checkpoints()
+
+
+def test_delta_checkpoints(tmp_path):
+    """Test that checkpoints between full ones only store changed tensors.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+    """
+    manual_seed(0)
+    model = Linear(5, 3)
+    model.bias.requires_grad_(False)
+    optimizer = Adam(model.parameters())
+    checkpointer = Checkpointer(
+        "run", model, optimizer, savedir=str(tmp_path), full_checkpoint_every=4
+    )
+    paths = []
+    for _ in range(4):
+        _train_step(model, optimizer)
+        paths.append(checkpointer.checkpoint_path(checkpointer.step_count))
+        checkpointer.step()
+    checkpointer.wait_for_pending_save()
+
+    # stepping removed the second checkpoint, but not the first one, which the
+    # latest checkpoint refers to
+    assert sorted(checkpointer.all_checkpoints()) == [paths[0], paths[2], paths[3]]
+
+    delta = load(paths[3])
+    assert delta["delta_base"] == os.path.basename(paths[0])
+    assert ("model", "bias") in delta["unchanged"]
+    assert delta["model"]["bias"] is None
+    assert ("model", "weight") not in delta["unchanged"]
+
+    _resume(str(tmp_path), model, optimizer)
+
+
+@mark.parametrize(
+    "optimizer_cls, hyperparameters, moments",
+    [
+        (Adam, {}, ["exp_avg", "exp_avg_sq"]),
+        (SGD, {"lr": 0.1, "momentum": 0.9}, ["momentum_buffer"]),
+    ],
+    ids=["adam", "sgd"],
+)
+def test_optimizer_dtype(
+    tmp_path, optimizer_cls: Type[Optimizer], hyperparameters: Dict, moments: List[str]
+):
+    """Test that moment estimates are stored in lower precision and restored.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+        optimizer_cls: The optimizer's class.
+        hyperparameters: The optimizer's hyperparameters.
+        moments: Names of the optimizer's moment estimates.
+    """
+    model = Linear(5, 3)
+    optimizer = optimizer_cls(model.parameters(), **hyperparameters)
+    checkpointer = _save(str(tmp_path), model, optimizer, optimizer_dtype=bfloat16)
+
+    (checkpoint,) = checkpointer.all_checkpoints()
+    saved = load(checkpoint)
+    assert len(saved["optimizer"]["state"]) == len(list(model.parameters()))
+    for param_idx, state in saved["optimizer"]["state"].items():
+        for name in moments:
+            assert state[name].dtype == bfloat16
+            assert (param_idx, name) in saved["optimizer_downcast"]
+
+    _, new_optimizer, _, _ = _resume(str(tmp_path), model, optimizer)
+    for param_idx, state in optimizer.state_dict()["state"].items():
+        new_state = new_optimizer.state_dict()["state"][param_idx]
+        for name in moments:
+            assert new_state[name].dtype == float32
+            assert allclose(new_state[name], state[name], rtol=1e-2)
+            # the original moments must not have been converted
+            assert state[name].dtype == float32
+
+
+def test_large_step_names(tmp_path):
+    """Test that checkpoints of large steps are named in decimal notation and found.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+    """
+    checkpointer = Checkpointer("run", Linear(5, 3), None, savedir=str(tmp_path))
+    checkpointer.step_count = 10**6 - 1
+    checkpointer.step()
+    checkpointer.step()
+    checkpointer.wait_for_pending_save()
+
+    # a new checkpointer reads the checkpoints from the file system
+    new_checkpointer = Checkpointer("run", Linear(5, 3), None, savedir=str(tmp_path))
+    latest = new_checkpointer.latest_checkpoint()
+    assert os.path.basename(latest) == "run_01000000.pt"
+    assert [os.path.basename(c) for c in new_checkpointer.old_checkpoints()] == [
+        "run_00999999.pt"
+    ]
+    new_checkpointer.load_latest_checkpoint()
+    assert new_checkpointer.step_count == 10**6 + 1
+
+
+def test_local_cache_dir(tmp_path):
+    """Test that checkpoints serialized to a local cache end up in the save directory.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+    """
+    model, savedir, cache_dir = Linear(5, 3), str(tmp_path / "ckpt"), tmp_path / "cache"
+    checkpointer = _save(savedir, model, local_cache_dir=str(cache_dir))
+    assert len(checkpointer.all_checkpoints()) == 1
+    assert not list(cache_dir.iterdir())
+    _resume(savedir, model)
+
+
+def test_tied_weights(tmp_path):
+    """Test that a tensor occurring multiple times in the model is saved once.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+    """
+    first, second = Linear(5, 5), Linear(5, 5)
+    second.weight = first.weight
+    checkpointer = _save(str(tmp_path), Sequential(first, second))
+
+    (checkpoint,) = checkpointer.all_checkpoints()
+    model_state = load(checkpoint)["model"]
+    assert model_state["0.weight"].data_ptr() == model_state["1.weight"].data_ptr()
+
+
+def test_directory_fsync_unsupported(tmp_path, monkeypatch: MonkeyPatch):
+    """Test that saving works on file systems that cannot sync directories.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+        monkeypatch: Fixture to make syncing directories fail.
+    """
+    fsync = os.fsync
+
+    def fsync_files_only(fd: int):
+        """Sync a file, but fail for directories.
+
+        Args:
+            fd: The file descriptor to sync.
+
+        Raises:
+            OSError: If `fd` refers to a directory.
+        """
+        if os.path.isdir(f"/proc/self/fd/{fd}"):
+            raise OSError("Cannot sync directories.")
+        fsync(fd)
+
+    monkeypatch.setattr(checkpointer, "fsync", fsync_files_only)
+    model = Linear(5, 3)
+    assert len(_save(str(tmp_path), model).all_checkpoints()) == 1
+    _resume(str(tmp_path), model)
+
+
+@mark.skipif(not os.path.exists("/proc/self/maps"), reason="Requires /proc.")
+def test_loaded_checkpoint_not_mapped(tmp_path):
+    """Test that resuming does not keep the checkpoint file memory-mapped.
+
+    Args:
+        tmp_path: Temporary directory to store checkpoints in.
+    """
+    model = Linear(5, 3)
+    optimizer = Adam(model.parameters())
+    _save(str(tmp_path), model, optimizer)
+    new_checkpointer, _, _, _ = _resume(str(tmp_path), model, optimizer)
+    new_checkpointer.remove_checkpoints()
+
+    with open("/proc/self/maps") as f:
+        assert str(tmp_path) not in f.read()
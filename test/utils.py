@@ -1,11 +1,14 @@
 """Utility functions for tests."""
 
-from subprocess import CalledProcessError, CompletedProcess, run
+from subprocess import PIPE, STDOUT, CalledProcessError, CompletedProcess, run
 from typing import List
 
 
 def run_verbose(cmd: List[str]) -> CompletedProcess:
-    """Run a command and print stdout & stderr if it fails.
+    """Run a command and print its output if it fails.
+
+    Standard output and error are captured as one interleaved stream of bytes,
+    which is only decoded if the command fails.
 
     Args:
         cmd: The command to run.
@@ -17,11 +20,7 @@ def run_verbose(cmd: List[str]) -> CompletedProcess:
         CalledProcessError: If the command fails.
     """
     try:
-        job = run(cmd, capture_output=True, text=True, check=True)
-        print("STDOUT:", job.stdout)
-        print("STDERR:", job.stderr)
-        return job
+        return run(cmd, stdout=PIPE, stderr=STDOUT, check=True)
     except CalledProcessError as e:
-        print("STDOUT:", e.stdout)
-        print("STDERR:", e.stderr)
+        print("OUTPUT:", e.stdout.decode(errors="replace"))
         raise e
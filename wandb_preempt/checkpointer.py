@@ -1,22 +1,258 @@
 """Class for handling checkpointing."""
 
+import os
+import re
+from bisect import insort
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import date, datetime
-from glob import glob
-from os import environ, getenv, getpid, makedirs, path, remove, rename
-from signal import SIGTERM, SIGUSR1, signal
+from inspect import signature
+from itertools import chain
+from multiprocessing import get_context
+from os import (
+    O_RDONLY,
+    DirEntry,
+    close,
+    environ,
+    fsync,
+    getenv,
+    getpid,
+    makedirs,
+    path,
+    remove,
+    rename,
+    scandir,
+)
+from shutil import copyfileobj
+from signal import SIG_IGN, SIGTERM, SIGUSR1, signal
 from subprocess import run
 from sys import exit
-from time import sleep, time
+from threading import Thread
+from time import monotonic, sleep, time
 from types import FrameType
-from typing import Dict, List, Optional, Set, Tuple, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import wandb
-from torch import cuda, device, get_rng_state, load, save, set_rng_state
+from torch import (
+    Tensor,
+    cuda,
+    dtype,
+    empty_like,
+    equal,
+    float32,
+    get_rng_state,
+    load,
+    save,
+    set_rng_state,
+)
 from torch.cuda.amp import GradScaler
 from torch.nn import Module
 from torch.optim import Optimizer
 from torch.optim.lr_scheduler import LRScheduler
 
+# Memory-mapping checkpoints when loading requires PyTorch 2.1
+_LOAD_SUPPORTS_MMAP = "mmap" in signature(load).parameters
+
+
+def _write_checkpoint(
+    data: Dict,
+    savepath: str,
+    delta_base: Optional[Tuple[str, Dict]] = None,
+    ready: Optional[List[cuda.Event]] = None,
+    cache_dir: Optional[str] = None,
+) -> None:
+    """Write a checkpoint to disk.
+
+    Args:
+        data: The checkpoint's content.
+        savepath: The path to store the checkpoint at.
+        delta_base: File name and content of the full checkpoint to only store the
+            changes to. If `None`, a full checkpoint is written. Default: `None`.
+        ready: CUDA events that mark the end of copying `data` to CPU, one per
+            device the data is copied from. If `None`, `data` is assumed to be ready.
+            Default: `None`.
+        cache_dir: Directory on fast local storage to serialize the checkpoint to
+            before copying it to `savepath`. If `None`, the checkpoint is serialized
+            to `savepath` directly. Default: `None`.
+    """
+    for event in [] if ready is None else ready:
+        event.synchronize()
+    if delta_base is not None:
+        base_name, base_data = delta_base
+        unchanged = []
+        data = _drop_unchanged(data, base_data, (), unchanged)
+        data["delta_base"] = base_name
+        data["unchanged"] = unchanged
+
+    # Save to a temporary file first, then move the temporary file to the target
+    # destination. This ensures we don't confuse a partially written file with
+    # a valid checkpoint if we are interrupted halfway through saving. (Moving is
+    # atomic, so it either happens or doesn't.)
+    tmp_savepath = f"{savepath}.tmp"
+    with open(tmp_savepath, "wb") as f:
+        if cache_dir is None:
+            save(data, f)
+        else:
+            # Serializing writes many small chunks, which is slow on network file
+            # systems. Copying the serialized file only performs large writes.
+            cachepath = path.join(cache_dir, path.basename(savepath))
+            try:
+                with open(cachepath, "wb") as cache:
+                    save(data, cache)
+                with open(cachepath, "rb") as cache:
+                    copyfileobj(cache, f, 16 * 2**20)
+            finally:
+                if path.exists(cachepath):
+                    remove(cachepath)
+        # The data must be on disk before the rename, otherwise a crash could leave
+        # us with a complete-looking but empty checkpoint
+        f.flush()
+        fsync(f.fileno())
+        # We will not read the checkpoint soon, so free the page cache for training
+        if hasattr(os, "posix_fadvise"):
+            from os import POSIX_FADV_DONTNEED, posix_fadvise
+
+            posix_fadvise(f.fileno(), 0, 0, POSIX_FADV_DONTNEED)
+    rename(tmp_savepath, savepath)
+
+    # Make the rename itself durable by syncing the directory (only possible on POSIX).
+    # This is best-effort: some network or FUSE file systems reject syncing a
+    # directory, but the checkpoint is already in place.
+    if hasattr(os, "O_DIRECTORY"):
+        from os import O_DIRECTORY
+        from os import open as open_fd
+
+        try:
+            dir_fd = open_fd(path.dirname(savepath), O_RDONLY | O_DIRECTORY)
+            try:
+                fsync(dir_fd)
+            finally:
+                close(dir_fd)
+        except OSError:
+            pass
+
+
+def _scandir(directory: str) -> List[DirEntry]:
+    """List the entries of a directory.
+
+    Args:
+        directory: The directory to list.
+
+    Returns:
+        The directory's entries, or an empty list if the directory does not exist.
+    """
+    try:
+        with scandir(directory) as entries:
+            return list(entries)
+    except FileNotFoundError:
+        return []
+
+
+def _drop_unchanged(obj: Any, base: Any, key: Tuple, unchanged: List[Tuple]) -> Any:
+    """Replace tensors that are identical to those of a base checkpoint by `None`.
+
+    Args:
+        obj: The (nested) state whose unchanged tensors are dropped. Modified in-place.
+        base: The corresponding (nested) state of the base checkpoint.
+        key: The position of `obj` inside the checkpoint.
+        unchanged: List to which the positions of dropped tensors are appended.
+
+    Returns:
+        The state without unchanged tensors.
+    """
+    if isinstance(obj, Tensor):
+        if (
+            isinstance(base, Tensor)
+            and obj.shape == base.shape
+            and obj.dtype == base.dtype
+            and equal(obj, base)
+        ):
+            unchanged.append(key)
+            return None
+    elif isinstance(obj, dict) and isinstance(base, dict):
+        for k, value in obj.items():
+            if k in base:
+                obj[k] = _drop_unchanged(value, base[k], key + (k,), unchanged)
+    elif isinstance(obj, list) and isinstance(base, list) and len(obj) == len(base):
+        for i, (value, base_value) in enumerate(zip(obj, base)):
+            obj[i] = _drop_unchanged(value, base_value, key + (i,), unchanged)
+    return obj
+
+
+def _restore_unchanged(data: Dict, base: Dict, unchanged: List[Tuple]) -> None:
+    """Fill in the tensors that were dropped because they matched a base checkpoint.
+
+    Args:
+        data: The checkpoint with dropped tensors. Modified in-place.
+        base: The base checkpoint.
+        unchanged: Positions of the dropped tensors.
+    """
+    for key in unchanged:
+        parent, base_parent = data, base
+        for k in key[:-1]:
+            parent, base_parent = parent[k], base_parent[k]
+        parent[key[-1]] = base_parent[key[-1]]
+
+
+def _clone_tensors(obj: Any) -> Any:
+    """Recursively clone all tensors of a (nested) object.
+
+    Args:
+        obj: The object to clone, e.g. a state dictionary.
+
+    Returns:
+        A copy of the object whose tensors are clones.
+    """
+    if isinstance(obj, Tensor):
+        return obj.clone()
+    if isinstance(obj, dict):
+        # `.copy` preserves the dictionary type, e.g. `OrderedDict`
+        copied = obj.copy()
+        for k, value in copied.items():
+            copied[k] = _clone_tensors(value)
+        return copied
+    if type(obj) in {list, tuple}:
+        return type(obj)(_clone_tensors(v) for v in obj)
+    return obj
+
+
+def _downcast_moments(
+    optimizer_state: Dict, moment_dtype: dtype
+) -> Tuple[Dict, List[Tuple[int, str]]]:
+    """Convert the `float32` moment estimates of an optimizer state to another type.
+
+    Args:
+        optimizer_state: The optimizer's state dictionary. Not modified.
+        moment_dtype: The data type to convert the moment estimates to.
+
+    Returns:
+        The optimizer state with converted moment estimates and the positions
+        `(parameter index, name)` of the converted tensors.
+    """
+    converted, state = [], {}
+    for param_idx, param_state in optimizer_state["state"].items():
+        # The optimizer's per-parameter states must not be modified, so we copy them
+        state[param_idx] = param_state.copy()
+        for name, value in param_state.items():
+            if (
+                (name.startswith("exp_avg") or name == "momentum_buffer")
+                and isinstance(value, Tensor)
+                and value.dtype == float32
+            ):
+                state[param_idx][name] = value.to(moment_dtype)
+                converted.append((param_idx, name))
+    return {**optimizer_state, "state": state}, converted
+
+
+def _ignore_preemption_signals() -> None:
+    """Ignore the signals that mark a run as pre-empted.
+
+    Used in the checkpoint writing process, which must not be terminated before the
+    main process has waited for it to finish writing.
+    """
+    signal(SIGUSR1, SIG_IGN)
+    signal(SIGTERM, SIG_IGN)
+
 
 class Checkpointer:
     """Class for storing, loading, and removing checkpoints.
@@ -28,7 +264,8 @@ class Checkpointer:
     - Create an instance of this class `checkpointer = Checkpointer(...)`.
     - At the end of each epoch, call
       [`checkpointer.step()`](../api/#wandb_preempt.Checkpointer.step) to save a
-      checkpoint.
+      checkpoint. Checkpoints are written to disk in a background thread (or
+      process) such that training can continue while the checkpoint is being saved.
       If the job received the `SIGUSR1` or `SIGTERM` signal, the checkpointer will
       requeue the Slurm job at the end of its checkpointing step.
     """
@@ -42,6 +279,10 @@ class Checkpointer:
         scaler: Optional[GradScaler] = None,
         savedir: str = "checkpoints",
         verbose: bool = False,
+        save_in_subprocess: bool = False,
+        full_checkpoint_every: int = 1,
+        optimizer_dtype: Optional[dtype] = None,
+        local_cache_dir: Optional[str] = None,
     ) -> None:
         """Set up a checkpointer.
 
@@ -59,8 +300,31 @@ class Checkpointer:
             savedir: Directory to store checkpoints in. Default: `'checkpoints'`.
             verbose: Whether to print messages about saving and loading checkpoints.
                 Default: `False`
+            save_in_subprocess: Whether to write checkpoints in a separate process
+                instead of a background thread. This avoids competing with training
+                for Python's global interpreter lock while serializing, at the cost of
+                starting a process. The training script must then be protected by an
+                `if __name__ == "__main__":` guard. Default: `False`.
+            full_checkpoint_every: Save a full checkpoint every this many checkpointing
+                steps. In between, checkpoints only contain the tensors that changed
+                since the last full checkpoint, which is kept on disk as long as they
+                need it. This reduces the amount of data written if parts of the
+                model are frozen, but keeps a second copy of the states in CPU memory.
+                Default: `1` (always save full checkpoints).
+            optimizer_dtype: Data type to store the optimizer's `float32` moment
+                estimates (Adam's `exp_avg`, `exp_avg_sq`, SGD's `momentum_buffer`) in,
+                e.g. `torch.bfloat16` to halve their size. They are converted back to
+                `float32` when loading, but lose precision. If `None`, they are stored
+                as is. Default: `None`.
+            local_cache_dir: Directory on fast node-local storage, e.g. the job's
+                `$SLURM_TMPDIR`, to serialize checkpoints to before they are copied
+                to `savedir` in one go. Useful if `savedir` is on a slow network file
+                system. If `None`, checkpoints are serialized to `savedir` directly.
+                Default: `None`.
         """
         self.time_created = time()
+        # Start of the monotonic clock used to report elapsed time
+        self._monotonic_created = monotonic()
         self.run_id = run_id
         self.model = model
         self.optimizer = optimizer
@@ -68,9 +332,58 @@ class Checkpointer:
         self.scaler = scaler
         self.verbose = verbose
         self.marked_preempted = False
+        self._preempt_signal: Optional[int] = None
         self.step_count = 0
         self.num_resumes = 0
 
+        # Checkpoints are written to disk by a background thread or process. We keep
+        # track of the last submitted write to wait for it before touching the
+        # checkpoints again.
+        self._writer = (
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=get_context("spawn"),
+                initializer=_ignore_preemption_signals,
+            )
+            if save_in_subprocess
+            else ThreadPoolExecutor(max_workers=1)
+        )
+        self._pending_save: Optional[Tuple[Future, int, str]] = None
+        self.save_in_subprocess = save_in_subprocess
+        self.local_cache_dir = local_cache_dir
+        if local_cache_dir is not None:
+            makedirs(local_cache_dir, exist_ok=True)
+
+        # Checkpoints are staged in CPU buffers which are allocated at the first save
+        # and re-used afterwards. Buffers for GPU tensors are pinned to speed up the
+        # device-to-host copy, which is carried out on a separate CUDA stream per GPU.
+        # The streams are created at the first save, only for the GPUs that hold
+        # model or optimizer states, so CPU models never initialize CUDA.
+        self._staging_buffers: Dict[Tuple, Tensor] = {}
+        self._copy_streams: Optional[Dict[int, cuda.Stream]] = None
+
+        # Checkpoints that only contain changed tensors refer to a full checkpoint,
+        # which must not be deleted. We remember its checkpointing step and its staged
+        # content to compare with.
+        self.full_checkpoint_every = full_checkpoint_every
+        self.optimizer_dtype = optimizer_dtype
+        self._delta_base_path: Optional[str] = None
+        self._delta_base: Optional[Tuple[int, Dict]] = None
+
+        # Checkpoints of this run on disk as (checkpointing step, path), sorted by step.
+        # Read from the file system on first use, then kept up to date when saving and
+        # removing.
+        self._checkpoints: Optional[List[Tuple[int, str]]] = None
+        self._checkpoint_name = re.compile(rf"{re.escape(run_id)}_(\d+)\.pt")
+        # Whether the job's checkpoint directory is known to exist
+        self._savedir_job_exists = False
+
+        # Devices whose random number generator states are checkpointed as (name,
+        # CUDA index), with index `None` for the CPU. Determined at the first save
+        # with the copy streams because the model may still be moved to GPU until
+        # then.
+        self._rng_devices: Optional[List[Tuple[str, Optional[int]]]] = None
+
         # Set up signal handler listening for SIGUSR1, when we receive this signal,
         # we mark the job as about to be pre-empted.
         # Similarly, try to gracefully end if we receive the SIGTERM signal.
@@ -78,7 +391,7 @@ class Checkpointer:
         signal(SIGTERM, self.mark_preempted)
 
         self.savedir = path.abspath(savedir)
-        self.maybe_print(f"Creating checkpoint directory: {self.savedir}.")
+        self.maybe_print("Creating checkpoint directory: %s.", self.savedir)
         makedirs(self.savedir, exist_ok=True)
 
         # Detect whether we are running inside a SLURM session
@@ -86,9 +399,9 @@ class Checkpointer:
         array_id = getenv("SLURM_ARRAY_JOB_ID")
         task_id = getenv("SLURM_ARRAY_TASK_ID")
         self.maybe_print(
-            f"SLURM job ID: {job_id}, array ID: {array_id}, task ID: {task_id}"
+            "SLURM job ID: %s, array ID: %s, task ID: %s", job_id, array_id, task_id
         )
-        self.uses_slurm = any(var is not None for var in {job_id, array_id, task_id})
+        self.uses_slurm = any(var is not None for var in (job_id, array_id, task_id))
 
         # We will create sub-folders in the directory supplied by the user where
         # checkpoints are stored. If we are on SLURM, we will use the `SLURM_JOB_ID`
@@ -103,7 +416,7 @@ class Checkpointer:
         if self.uses_slurm:
             filename = f"{job_id}.pid"
             pid = str(getpid())
-            self.maybe_print(f"Writing PID {pid} to file {filename}.")
+            self.maybe_print("Writing PID %s to file %s.", pid, filename)
             with open(filename, "w") as f:
                 f.write(pid)
 
@@ -118,10 +431,9 @@ class Checkpointer:
             sig: The signal number.
             frame: The current stack frame.
         """
-        self.maybe_print(
-            f"Received signal {sig}. Marking as pre-empted and will halt and requeue"
-            " the job at next call of checkpointer.step()."
-        )
+        # Only record the signal. Printing here could interrupt a print of the main
+        # program and fail with a re-entrant call error, so `step` reports it instead
+        self._preempt_signal = sig
         self.marked_preempted = True
 
     def checkpoint_path(self, counter: int) -> str:
@@ -133,7 +445,9 @@ class Checkpointer:
         Returns:
             The path to the checkpoint file.
         """
-        return path.join(self.savedir_job, f"{self.run_id}_{counter:08g}.pt")
+        # Decimal notation also for large steps, which `g` formats in exponential
+        # notation from 10^6 on. Names of smaller steps are unchanged.
+        return path.join(self.savedir_job, f"{self.run_id}_{counter:08d}.pt")
 
     def save_checkpoint(self, extra_info: Dict) -> None:
         """Save a checkpoint.
@@ -141,22 +455,30 @@ class Checkpointer:
         Stores optimizer, model, lr scheduler, gradient scaler, and random number
         generator states.
 
+        The states are copied to CPU, then the checkpoint is written to disk in a
+        background thread or process. Use
+        [`Checkpointer.wait_for_pending_save`](../api/#wandb_preempt.Checkpointer.wait_for_pending_save)
+        to block until the checkpoint has been written.
+
         Args:
             extra_info: Additional information to store in the checkpoint.
         """
+        # Only one checkpoint is written at a time
+        self.wait_for_pending_save()
         savepath = self.checkpoint_path(self.step_count)
 
-        # get random number generator states for all devices
-        devices = [device("cpu")]
-        if cuda.is_available():
-            devices.extend([device(f"cuda:{i}") for i in range(cuda.device_count())])
+        if self._copy_streams is None:
+            self._set_up_devices()
 
+        # get random number generator states for the devices in use
         rng_states = {
-            str(dev): cuda.get_rng_state(dev) if "cuda" in str(dev) else get_rng_state()
-            for dev in devices
+            name: get_rng_state() if idx is None else cuda.get_rng_state(idx)
+            for name, idx in self._rng_devices
         }
         data = {
-            "model": self.model.state_dict(),
+            # The tensors are copied into staging buffers below, so we do not need
+            # `state_dict` to detach each of them
+            "model": self.model.state_dict(keep_vars=True),
             "rng_states": rng_states,
             "checkpoint_step": self.step_count,
             "resumes": self.num_resumes,
@@ -164,25 +486,182 @@ class Checkpointer:
         }
         if self.optimizer is not None:
             data["optimizer"] = self.optimizer.state_dict()
+            if self.optimizer_dtype is not None:
+                data["optimizer"], data["optimizer_downcast"] = _downcast_moments(
+                    data["optimizer"], self.optimizer_dtype
+                )
         if self.lr_scheduler is not None:
             data["lr_scheduler"] = self.lr_scheduler.state_dict()
         if self.scaler is not None:
             data["scaler"] = self.scaler.state_dict()
 
-        self.maybe_print(f"Saving checkpoint {savepath}.")
-        if not path.exists(path.dirname(savepath)):
+        full = (
+            self._delta_base is None
+            or self.step_count - self._delta_base[0] >= self.full_checkpoint_every
+        )
+        # Snapshot the states so training can modify them while we are writing. The
+        # snapshot of the last full checkpoint must stay intact to compare with, so
+        # other checkpoints are staged in separate buffers.
+        data, ready = self._stage_on_copy_streams(
+            data, ("full",) if full else ("delta",)
+        )
+
+        if full:
+            delta_base = None
+            self._delta_base_path = savepath
+            self._delta_base = (self.step_count, data)
+        else:
+            delta_base = (path.basename(self._delta_base_path), self._delta_base[1])
+
+        if not (self._savedir_job_exists or path.exists(self.savedir_job)):
             # We protect this inside an if statement because sometimes the server is
             # configured so the checkpoint directory is automatically created without
             # us having the permissions to create it ourselves.
-            makedirs(path.dirname(savepath), exist_ok=True)
+            makedirs(self.savedir_job, exist_ok=True)
+        self._savedir_job_exists = True
+
+        self.maybe_print("Saving checkpoint %s.", savepath)
+        pending = self._writer.submit(
+            _write_checkpoint, data, savepath, delta_base, ready, self.local_cache_dir
+        )
+        self._pending_save = (pending, self.step_count, savepath)
+
+    def _set_up_devices(self) -> None:
+        """Determine the GPUs that hold states and create a copy stream for each.
+
+        Only the random number generators of these GPUs are checkpointed. Touching
+        other GPUs would initialize CUDA on them.
+        """
+        tensors = chain(self.model.parameters(), self.model.buffers())
+        if self.optimizer is not None:
+            tensors = chain(
+                tensors, *(state.values() for state in self.optimizer.state.values())
+            )
+        cuda_indices = sorted(
+            {t.get_device() for t in tensors if isinstance(t, Tensor) and t.is_cuda}
+        )
+        self._rng_devices = [("cpu", None)] + [
+            (f"cuda:{idx}", idx) for idx in cuda_indices
+        ]
+        self._copy_streams = {idx: cuda.Stream(device=idx) for idx in cuda_indices}
 
-        # Save to a temporary file first, then move the temporary file to the target
-        # destination. This ensures we don't confuse a partially written file with
-        # a valid checkpoint if we are interrupted halfway through saving. (Moving is
-        # atomic, so it either happens or doesn't.)
-        tmp_savepath = f"{savepath}.tmp"
-        save(data, tmp_savepath)
-        rename(tmp_savepath, savepath)
+    def _stage_on_copy_streams(
+        self, data: Dict, key: Tuple
+    ) -> Tuple[Dict, Optional[List[cuda.Event]]]:
+        """Stage the content of a checkpoint, copying GPU tensors on the copy streams.
+
+        Args:
+            data: The checkpoint's content.
+            key: The position of `data` inside the staging buffers.
+
+        Returns:
+            The staged content and CUDA events, one per GPU, that mark the end of
+            copying it. The writer must wait for them before reading the content.
+            `None` if the copies have already finished.
+        """
+        if not self._copy_streams:
+            return self._stage(data, key=key), None
+
+        with ExitStack() as stack:
+            for idx, stream in self._copy_streams.items():
+                # The copy must see the results of all work queued so far
+                stream.wait_stream(cuda.current_stream(idx))
+                stack.enter_context(cuda.stream(stream))
+            data = self._stage(data, key=key)
+
+        if self.save_in_subprocess:
+            # CUDA events cannot be shared with the writer process
+            for stream in self._copy_streams.values():
+                stream.synchronize()
+            return data, None
+
+        # Let the writer thread wait for the copies instead of blocking here. Training
+        # kernels queued from now on must not modify the states before they are
+        # copied, so they wait for the copies, too.
+        ready = []
+        for idx, stream in self._copy_streams.items():
+            ready.append(stream.record_event())
+            cuda.current_stream(idx).wait_event(ready[-1])
+        return data, ready
+
+    def _stage(
+        self, obj: Any, key: Tuple = (), staged: Optional[Dict[Tuple, Tensor]] = None
+    ) -> Any:
+        """Recursively copy all tensors of a (nested) state into CPU staging buffers.
+
+        The copy is decoupled from the training state, i.e. modifying the model or
+        optimizer after the copy was made does not affect the copy.
+
+        Args:
+            obj: The object to copy, e.g. a state dictionary.
+            key: The position of `obj` inside the checkpoint. Used to identify its
+                staging buffer. Default: `()`.
+            staged: The tensors staged so far. Used to stage the same tensor that
+                occurs multiple times in `obj`, e.g. tied weights, only once. If
+                `None`, a new record is started. Default: `None`.
+
+        Returns:
+            A copy of the object whose tensors are CPU staging buffers.
+        """
+        staged = {} if staged is None else staged
+        if isinstance(obj, Tensor):
+            # The same tensor must be staged into the same buffer, otherwise it is
+            # written multiple times
+            view = (
+                obj.device,
+                obj.untyped_storage().data_ptr(),
+                obj.storage_offset(),
+                obj.shape,
+                obj.stride(),
+                obj.dtype,
+            )
+            if view in staged:
+                return staged[view]
+            buffer = self._staging_buffers.get(key)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = empty_like(
+                    obj,
+                    device="cpu",
+                    pin_memory=obj.is_cuda and not self.save_in_subprocess,
+                )
+                # Tensors in shared memory are handed to the writing process without
+                # copying them
+                if self.save_in_subprocess:
+                    buffer.share_memory_()
+                self._staging_buffers[key] = buffer
+            # Only copies on a copy stream are waited for before writing
+            non_blocking = obj.is_cuda and obj.get_device() in (
+                self._copy_streams or {}
+            )
+            staged[view] = buffer.copy_(obj.detach(), non_blocking=non_blocking)
+            return staged[view]
+        if isinstance(obj, dict):
+            # `.copy` preserves the dictionary type, e.g. `OrderedDict`
+            copied = obj.copy()
+            for k, value in copied.items():
+                copied[k] = self._stage(value, key + (k,), staged)
+            # `Module.state_dict` stores version information in an attribute
+            if hasattr(obj, "_metadata"):
+                copied._metadata = obj._metadata
+            return copied
+        if type(obj) in {list, tuple}:
+            return type(obj)(
+                self._stage(v, key + (i,), staged) for i, v in enumerate(obj)
+            )
+        return obj
+
+    def wait_for_pending_save(self) -> None:
+        """Block until the last checkpoint submitted for saving is written to disk.
+
+        Re-raises errors that occurred while writing the checkpoint.
+        """
+        if self._pending_save is not None:
+            (pending, step, savepath), self._pending_save = self._pending_save, None
+            pending.result()
+            # If the list of checkpoints is not populated yet, it will contain the new
+            # checkpoint once it is read from the file system
+            if self._checkpoints is not None:
+                insort(self._checkpoints, (step, savepath))
 
     def load_latest_checkpoint(
         self, weights_only: bool = True, **kwargs
@@ -203,7 +682,9 @@ class Checkpointer:
                 Default: `True`.
             **kwargs: Additional keyword arguments to pass to the
                 [`torch.load`](https://pytorch.org/docs/stable/generated/torch.load.html)
-                function.
+                function. By default, checkpoints are loaded to CPU and memory-mapped
+                (if supported by the installed PyTorch version) so that tensors are
+                read from disk on demand rather than all at once.
 
         Returns:
             loaded_step: The index of the checkpoint that was loaded, or `None` if no
@@ -212,18 +693,25 @@ class Checkpointer:
                 function when the checkpoint was saved, or an empty dictionary if there
                 is no extra information.
         """
+        self.wait_for_pending_save()
         loadpath = self.latest_checkpoint()
         if loadpath is None:
             self.maybe_print("No checkpoint found. Starting from scratch.")
             return None, {}
 
-        self.maybe_print(f"Loading checkpoint {loadpath}.")
+        self.maybe_print("Loading checkpoint %s.", loadpath)
+
+        data = self._load_file(loadpath, weights_only, **kwargs)
 
-        data = load(loadpath, weights_only=weights_only, **kwargs)
         self.maybe_print("Loading model.")
         self.model.load_state_dict(data["model"])
         if self.optimizer is not None:
             self.maybe_print("Loading optimizer.")
+            optimizer_state = data["optimizer"]["state"]
+            for param_idx, name in data.get("optimizer_downcast", []):
+                optimizer_state[param_idx][name] = optimizer_state[param_idx][name].to(
+                    float32
+                )
             self.optimizer.load_state_dict(data["optimizer"])
         if self.lr_scheduler is not None:
             self.maybe_print("Loading lr scheduler.")
@@ -248,29 +736,104 @@ class Checkpointer:
         # it after saving - it tracks the index of the next checkpoint to be saved.
         return data["checkpoint_step"], data["extra_info"]
 
+    def _load_file(self, loadpath: str, weights_only: bool, **kwargs) -> Dict:
+        """Load a checkpoint file, including the unchanged states it refers to.
+
+        Args:
+            loadpath: The path of the checkpoint.
+            weights_only: Whether to only unpickle objects that are safe to unpickle.
+            **kwargs: Additional keyword arguments to pass to `torch.load`.
+
+        Returns:
+            The checkpoint's content.
+        """
+        kwargs.setdefault("map_location", "cpu")
+        if _LOAD_SUPPORTS_MMAP:
+            kwargs.setdefault("mmap", True)
+        data = load(loadpath, weights_only=weights_only, **kwargs)
+        if "delta_base" in data:
+            basepath = path.join(path.dirname(loadpath), data["delta_base"])
+            self.maybe_print("Loading unchanged states from %s.", basepath)
+            base = load(basepath, weights_only=weights_only, **kwargs)
+            _restore_unchanged(data, base, data["unchanged"])
+            # The latest checkpoint needs its base until we saved a full checkpoint
+            self._delta_base_path = basepath
+
+        if kwargs.get("mmap", False):
+            # The model's `load_state_dict` copies the tensors, but other states, e.g.
+            # the optimizer's, would keep using the memory-mapped ones. The files
+            # would then stay mapped, which prevents removing them on some systems.
+            data = {
+                k: v if k == "model" else _clone_tensors(v) for k, v in data.items()
+            }
+        return data
+
     def remove_checkpoints(self, keep_latest: bool = False):
         """Remove checkpoints.
 
+        Waits for checkpoints that are currently being written.
+
         Args:
             keep_latest: Whether to keep the latest checkpoint. Default: `False`.
 
         Raises:
             RuntimeError: If a non-`.pt` file is found in the checkpoint directory.
         """
-        checkpoints = self.old_checkpoints() if keep_latest else self.all_checkpoints()
+        self.wait_for_pending_save()
+        checkpoints = (
+            self.old_checkpoints()
+            if keep_latest
+            else [c for _, c in self._existing_checkpoints()]
+        )
+        if not keep_latest:
+            # Later checkpoints cannot refer to deleted ones
+            self._delta_base_path, self._delta_base = None, None
         for checkpoint in checkpoints:
             if not checkpoint.endswith(".pt"):
                 raise RuntimeError(f"Was asked to delete a non-.pt-file: {checkpoint}.")
-            self.maybe_print(f"Removing checkpoint {checkpoint}.")
+            self.maybe_print("Removing checkpoint %s.", checkpoint)
             remove(checkpoint)
 
+        removed = set(checkpoints)
+        self._checkpoints = [
+            (step, c) for step, c in self._existing_checkpoints() if c not in removed
+        ]
+
     def all_checkpoints(self) -> List[str]:
         """Return all existing checkpoints for a run.
 
         Returns:
             A list of paths to all existing checkpoints.
         """
-        return glob(path.join(self.savedir, "*", f"{self.run_id}_*.pt"))
+        # Checkpoints of a resumed run live in the directories of previous jobs, so
+        # we have to look into all sub-directories
+        prefix = f"{self.run_id}_"
+        return [
+            entry.path
+            for job_dir in _scandir(self.savedir)
+            if job_dir.is_dir()
+            for entry in _scandir(job_dir.path)
+            if entry.name.startswith(prefix) and entry.name.endswith(".pt")
+        ]
+
+    def _existing_checkpoints(self) -> List[Tuple[int, str]]:
+        """Return the checkpoints of this run, sorted by checkpointing step.
+
+        Unlike `all_checkpoints`, this does not search the file system every time.
+
+        Returns:
+            A list of `(checkpointing step, path)` for all existing checkpoints,
+            sorted by checkpointing step.
+        """
+        if self._checkpoints is None:
+            self._checkpoints = []
+            for checkpoint in self.all_checkpoints():
+                # skip checkpoints of other runs whose ID starts with ours
+                match = self._checkpoint_name.fullmatch(path.basename(checkpoint))
+                if match is not None:
+                    self._checkpoints.append((int(match.group(1)), checkpoint))
+            self._checkpoints.sort()
+        return self._checkpoints
 
     @staticmethod
     def checkpointed_run_ids(savedir: str = "checkpoints") -> Set[str]:
@@ -283,9 +846,9 @@ class Checkpointer:
             A set of run IDs that have at least one checkpoint.
         """
         run_ids = set()
-        for checkpoint in glob(path.join(savedir, "*.pt")):
-            run_id = path.basename(checkpoint).split("_")[0]
-            run_ids.add(run_id)
+        for entry in _scandir(savedir):
+            if entry.name.endswith(".pt"):
+                run_ids.add(entry.name.split("_")[0])
         return run_ids
 
     def latest_checkpoint(self) -> Union[None, str]:
@@ -294,37 +857,35 @@ class Checkpointer:
         Returns:
             The path to the latest checkpoint, or `None` if no checkpoints exist.
         """
-        checkpoints_sorted = sorted(
-            self.all_checkpoints(),
-            key=lambda x: int(path.basename(x).replace(".pt", "").split("_")[-1]),
-        )
-        return checkpoints_sorted[-1] if checkpoints_sorted else None
+        checkpoints = self._existing_checkpoints()
+        return checkpoints[-1][1] if checkpoints else None
 
     def old_checkpoints(self) -> List[str]:
-        """Return all but the latest checkpoint.
+        """Return all but the latest checkpoint and the full checkpoint it requires.
 
         Returns:
-            A list of paths to all but the latest checkpoint.
+            A list of paths to all but the latest checkpoint and the full checkpoint
+            it requires.
         """
-        existing = self.all_checkpoints()
+        existing = self._existing_checkpoints()
+        return [c for _, c in existing[:-1] if c != self._delta_base_path]
 
-        if existing:
-            latest = self.latest_checkpoint()
-            existing.remove(latest)
-
-        return existing
-
-    def maybe_print(self, msg: str, verbose: Optional[bool] = None) -> None:
+    def maybe_print(self, msg: str, *args: Any, verbose: Optional[bool] = None) -> None:
         """Print a message with time stamp if verbose mode is enabled.
 
         Args:
-            msg: The message to print.
+            msg: The message to print. If `args` are given, it is formatted as
+                `msg % args`, which only happens if the message is printed.
+            *args: Values for the `%`-style placeholders in `msg`.
             verbose: Whether to print the message. If `None`, the instance's `verbose`
                 attribute is used. Default: `None`.
         """
         verbose = self.verbose if verbose is None else verbose
         if verbose:
-            elapsed = time() - self.time_created
+            # A monotonic clock is not affected by changes of the system time
+            elapsed = monotonic() - self._monotonic_created
+            if args:
+                msg = msg % args
             print(f"[{elapsed:.1f} s | {datetime.now()}] {msg}")
 
     def maybe_requeue_slurm_job(self):
@@ -340,7 +901,7 @@ class Checkpointer:
         requeue_id = f"{array_id}_{task_id}" if uses_array else job_id
 
         cmd = ["scontrol", "requeue", requeue_id]
-        self.maybe_print(f"Requeuing SLURM job with `{' '.join(cmd)}`.")
+        self.maybe_print("Requeuing SLURM job with `%s`.", " ".join(cmd))
         run(cmd, check=True)
 
     def preempt_wandb_run(self):
@@ -349,14 +910,21 @@ class Checkpointer:
         wandb.mark_preempting()
         self.maybe_print("Terminating wandb with non-zero exit code.")
         wandb.finish(exit_code=1)
-        self.maybe_print("Sleeping for 15 s to give wandb enough time.")
-        sleep(15)
+        if hasattr(wandb, "teardown"):
+            # Wait until wandb has shut down, but at most 15 s in case syncing hangs
+            self.maybe_print("Waiting (at most 15 s) for wandb to shut down.")
+            teardown = Thread(target=wandb.teardown, daemon=True)
+            teardown.start()
+            teardown.join(timeout=15)
+        else:
+            self.maybe_print("Sleeping for 15 s to give wandb enough time.")
+            sleep(15)
 
     def step(self, extra_info: Optional[Dict] = None):
         """Perform a checkpointing step.
 
-        Save the checkpoint. If we were pre-empted we requeue the job
-        and exit the training script after saving.
+        Save the checkpoint in the background and remove stale checkpoints. If we
+        were pre-empted we requeue the job and exit the training script after saving.
 
         Args:
             extra_info: Additional information to save in the checkpoint. This
@@ -364,13 +932,18 @@ class Checkpointer:
                 [`Checkpointer.load_latest_checkpoint`](../api/#wandb_preempt.Checkpointer.load_latest_checkpoint).
                 By default, an empty dictionary is saved.
         """
-        self.save_checkpoint({} if extra_info is None else extra_info)
-        # Remove stale checkpoints
+        # Remove stale checkpoints. This waits until the previous checkpoint is
+        # written. It is kept until the current checkpoint is on disk.
         self.remove_checkpoints(keep_latest=True)
+        self.save_checkpoint({} if extra_info is None else extra_info)
 
         # requeue the job if the run was marked as pre-empted and exit
         if self.marked_preempted:
-            self.maybe_print("Run was marked as pre-empted via signal.")
+            self.maybe_print(
+                "Run was marked as pre-empted via signal %s.", self._preempt_signal
+            )
+            # Wait for the checkpoint to be written and remove its predecessor
+            self.remove_checkpoints(keep_latest=True)
             self.preempt_wandb_run()
             self.maybe_requeue_slurm_job()
             self.maybe_print("Exiting with error code 1.")